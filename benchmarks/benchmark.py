@@ -0,0 +1,290 @@
+"""
+Throughput benchmarks of lmdbdict.
+
+It generates synthetic lmdbdicts of several sizes and value size
+distributions, times the read and write paths, and writes the results as
+json so that two runs can be compared.
+
+    python benchmarks/benchmark.py --num-items 1000 10000 --value-sizes 100 100000 -o results.json
+    python benchmarks/benchmark.py --compare old.json results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import multiprocessing
+
+import lmdb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lmdbdict as lmdbdict_module  # noqa: E402
+from lmdbdict import lmdbdict  # noqa: E402
+from lmdbdict.methods import DUMPS_FUNC  # noqa: E402
+
+
+def make_values(num_items, value_size, distribution, seed=0):
+    """
+    Random bytes values whose sizes are either all value_size ('fixed')
+    or lognormally distributed with median value_size ('lognormal').
+    """
+    rng = random.Random(seed)
+    if distribution == 'fixed':
+        sizes = [value_size] * num_items
+    elif distribution == 'lognormal':
+        sizes = [max(1, int(value_size * rng.lognormvariate(0, 1))) for _ in range(num_items)]
+    else:
+        raise ValueError(f'unknown distribution {distribution}')
+    # Slicing one random blob is much faster than generating each value
+    blob = os.urandom(max(sizes) * 2)
+    values = []
+    for size in sizes:
+        start = rng.randrange(len(blob) - size + 1)
+        values.append(blob[start:start + size])
+    return values
+
+
+def make_codec_value(codec, value):
+    """
+    An input that the codec accepts, of about the same size as value.
+    """
+    if codec in ('ascii', 'utf8'):
+        return value.hex()[:len(value)]
+    return value
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.start
+
+
+def _result(name, params, n_ops, n_bytes, seconds):
+    return dict(
+        name=name,
+        params=params,
+        n_ops=n_ops,
+        n_bytes=n_bytes,
+        seconds=seconds,
+        ops_per_sec=n_ops / seconds if seconds else None,
+        mb_per_sec=n_bytes / seconds / 2 ** 20 if seconds else None,
+    )
+
+
+def write_store(path, values, **kwargs):
+    db = lmdbdict(path, 'w', value_method='identity', **kwargs)
+    db.update(dict(enumerate(values)))
+    del db
+
+
+_worker_db = None
+
+
+def _worker_init(db):
+    global _worker_db
+    _worker_db = db
+
+
+def _worker_read(keys):
+    return sum(len(_worker_db[key]) for key in keys)
+
+
+def _worker_ready(_):
+    # Hold the worker for a moment so that each worker takes one task
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def bench_store(workdir, num_items, value_size, distribution, args):
+    """
+    Benchmarks of one synthetic store.
+    """
+    params = dict(num_items=num_items, value_size=value_size, distribution=distribution)
+    values = make_values(num_items, value_size, distribution)
+    total_bytes = sum(map(len, values))
+    path = os.path.join(workdir, f'{num_items}_{value_size}_{distribution}.lmdb')
+    results = []
+
+    with Timer() as t:
+        write_store(path, values)
+    results.append(_result('update', params, num_items, total_bytes, t.seconds))
+
+    with Timer() as t:
+        db = lmdbdict(path, 'r')
+    results.append(_result('open', params, 1, 0, t.seconds))
+
+    rng = random.Random(1)
+    keys = [rng.randrange(num_items) for _ in range(args.num_reads)]
+    n_bytes = sum(len(values[key]) for key in keys)
+    with Timer() as t:
+        for key in keys:
+            db[key]
+    results.append(_result('getitem_random', params, len(keys), n_bytes, t.seconds))
+
+    # unsafe skips the linear scan of the keys
+    db.unsafe = True
+    with Timer() as t:
+        for key in keys:
+            db[key]
+    results.append(_result('getitem_random_unsafe', params, len(keys), n_bytes, t.seconds))
+
+    with Timer() as t:
+        for i in range(0, len(keys), args.batch_size):
+            db.get_batch(keys[i:i + args.batch_size])
+    results.append(_result('get_batch', dict(params, batch_size=args.batch_size),
+                           len(keys), n_bytes, t.seconds))
+    db.unsafe = False
+
+    with Timer() as t:
+        for _ in db.sequential_iter():
+            pass
+    results.append(_result('sequential_iter', params, num_items, total_bytes, t.seconds))
+
+    # DataLoader style: the lmdbdict is pickled to each worker process. With
+    # fork the initargs are inherited instead of pickled, so use spawn.
+    batches = [keys[i:i + args.batch_size] for i in range(0, len(keys), args.batch_size)]
+    # Only the reads are timed, the worker startup is reported on its own.
+    ctx = multiprocessing.get_context('spawn')
+    with Timer() as t:
+        pool = ctx.Pool(args.workers, initializer=_worker_init, initargs=(db,))
+        # A worker only runs tasks once it's initialized
+        while len(set(pool.map(_worker_ready, range(args.workers), chunksize=1))) < args.workers:
+            pass
+    results.append(_result('pool_startup', dict(params, workers=args.workers),
+                           args.workers, 0, t.seconds))
+    with pool:
+        with Timer() as t:
+            sum(pool.imap(_worker_read, batches))
+    results.append(_result('multiprocess_read', dict(params, workers=args.workers),
+                           len(keys), n_bytes, t.seconds))
+    del db
+    return results
+
+
+def bench_codecs(workdir, num_items, value_size, args):
+    """
+    Write and read time of each value method in lmdbdict.methods.
+    """
+    results = []
+    values = make_values(num_items, value_size, 'fixed')
+    for codec in DUMPS_FUNC:
+        params = dict(num_items=num_items, value_size=value_size, codec=codec)
+        inputs = [make_codec_value(codec, v) for v in values]
+        path = os.path.join(workdir, f'codec_{codec}.lmdb')
+        try:
+            db = lmdbdict(path, 'w', value_method=codec)
+            with Timer() as t:
+                db.update(dict(enumerate(inputs)))
+                db.flush()
+            del db
+        except Exception as e:
+            print(f'Skip codec {codec}: {e!r}')
+            continue
+        results.append(_result('codec_write', params, num_items, num_items * value_size, t.seconds))
+        db = lmdbdict(path, 'r', unsafe=True)
+        with Timer() as t:
+            for key in range(num_items):
+                db[key]
+        results.append(_result('codec_read', params, num_items, num_items * value_size, t.seconds))
+        del db
+    return results
+
+
+def bench_folder2lmdb(workdir, num_items, value_size, args):
+    """
+    Ingest a folder of files with folder2lmdb.py (needs torch).
+    """
+    try:
+        from folder2lmdb import folder2lmdb_
+    except ImportError as e:
+        print(f'Skip folder2lmdb: {e!r}')
+        return []
+    folder = os.path.join(workdir, 'folder')
+    values = make_values(num_items, value_size, 'fixed')
+    for i, value in enumerate(values):
+        sub = os.path.join(folder, str(i % 10))
+        os.makedirs(sub, exist_ok=True)
+        with open(os.path.join(sub, f'{i}.bin'), 'wb') as f:
+            f.write(value)
+    params = dict(num_items=num_items, value_size=value_size, workers=args.workers)
+    with Timer() as t:
+        folder2lmdb_(folder, os.path.join(workdir, 'folder.lmdb'), num_workers=args.workers)
+    shutil.rmtree(folder)
+    return [_result('folder2lmdb', params, num_items, num_items * value_size, t.seconds)]
+
+
+def environment():
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        lmdb=lmdb.__version__,
+        lmdbdict=lmdbdict_module.__version__,
+        cpu_count=os.cpu_count(),
+    )
+
+
+def compare(old_path, new_path):
+    """
+    Print the speedup of each benchmark in new_path over old_path.
+    """
+    def load(path):
+        with open(path) as f:
+            results = json.load(f)['results']
+        return {(r['name'], json.dumps(r['params'], sort_keys=True)): r for r in results}
+    old, new = load(old_path), load(new_path)
+    for key in sorted(old.keys() & new.keys()):
+        speedup = old[key]['seconds'] / new[key]['seconds'] if new[key]['seconds'] else float('inf')
+        print(f'{key[0]:24s} {key[1]:70s} {speedup:6.2f}x')
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-items', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--value-sizes', type=int, nargs='+', default=[100, 10000])
+    parser.add_argument('--distributions', nargs='+', default=['fixed', 'lognormal'])
+    parser.add_argument('--num-reads', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--skip-folder2lmdb', action='store_true')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='where to put the synthetic stores, a temporary directory by default')
+    parser.add_argument('-o', '--output', type=str, default=None)
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    workdir = tempfile.mkdtemp(dir=args.workdir)
+    results = []
+    try:
+        for num_items in args.num_items:
+            for value_size in args.value_sizes:
+                for distribution in args.distributions:
+                    print(f'Benchmarking {num_items} items of {distribution} size {value_size}')
+                    results += bench_store(workdir, num_items, value_size, distribution, args)
+        results += bench_codecs(workdir, min(args.num_items), min(args.value_sizes), args)
+        if not args.skip_folder2lmdb:
+            results += bench_folder2lmdb(workdir, min(args.num_items), min(args.value_sizes), args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for r in results:
+        print(f"{r['name']:24s} {json.dumps(r['params']):90s} {r['ops_per_sec']:12.1f} ops/s"
+              f" {r['mb_per_sec']:9.1f} MB/s")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(environment=environment(), results=results), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+# Parallel streaming export and verification of lmdbdicts
+import os
+import io
+import time
+import pickle
+import hashlib
+import tarfile
+import collections
+import multiprocessing
+from .lmdbdict import lmdbdict, RESERVED
+from .parallel import parallel_build
+
+# Segments hold at most about this many records, so the memory of a
+# task and of its result doesn't grow with the store
+MAX_SEGMENT_RECORDS = 100000
+
+# The lmdbdicts opened in each worker, set by _init_worker
+_dbs = None
+_init_error = None
+
+
+def _init_worker(lmdb_paths):
+    global _dbs, _init_error
+    try:
+        # lmdb can't open the same env twice in a process
+        opened = {}
+        for lmdb_path in lmdb_paths:
+            if os.path.abspath(lmdb_path) not in opened:
+                opened[os.path.abspath(lmdb_path)] = lmdbdict(lmdb_path, 'r')
+        _dbs = [opened[os.path.abspath(lmdb_path)] for lmdb_path in lmdb_paths]
+    except Exception as e:
+        # An exception in the initializer makes the pool respawn the workers
+        # forever, so it's raised by the tasks instead
+        _init_error = e
+
+
+def _worker_dbs():
+    if _init_error is not None:
+        raise RuntimeError('failed to open the lmdbdicts in the worker') from _init_error
+    return _dbs
+
+
+def segments(db, num_segments, max_records=MAX_SEGMENT_RECORDS):
+    """
+    Split the encoded key range of db into [start, end) ranges of about the
+    same number of keys. The last end is None. There are at least
+    num_segments of them, more if needed to keep each under max_records.
+    The bounds are found by walking the keys with a cursor.
+    """
+    # The entries of the main db, including the few internal ones
+    n = db.env.stat()['entries']
+    num_segments = max(1, min(max(num_segments, -(-n // max_records)), n))
+    positions = {n * i // num_segments: i for i in range(1, num_segments)}
+    bounds = [b'']
+    cursor = db.db_txn.cursor()
+    for position, k in enumerate(cursor.iternext(keys=True, values=False)):
+        if position in positions:
+            bounds.append(k)
+            if len(bounds) == num_segments:
+                break
+    bounds.append(None)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _segments(lmdb_path, num_segments):
+    # The lmdb is closed afterwards, so that the workers can open it
+    db = lmdbdict(lmdb_path, 'r')
+    out = segments(db, num_segments)
+    db.env.close()
+    return out
+
+
+def _iter_segment(db, segment):
+    """
+    Iterate the (encoded key, encoded value) pairs of the segment with a
+    cursor. Values are read as in the db, see _raw_value.
+    """
+    start, end = segment
+    cursor = db.db_txn.cursor()
+    if not cursor.set_range(start):
+        return
+    # The values in the main db are the encoded values, unless they are
+    # kept in the sub dbs
+    indirect = db._fields is not None or db._dedup or db._chunks
+    for k, v in cursor:
+        if end is not None and k >= end:
+            break
+        if k not in RESERVED and k not in db._field_db_names:
+            yield k, _raw_value(db, k) if indirect else v
+
+
+def _raw_value(db, dumped_key):
+    """
+    The encoded value of dumped_key, the encoded fields for records.
+    """
+    if db._fields is not None:
+        return pickle.dumps([db.db_txn.get(dumped_key, db=db._get_sub_db(name))
+                             for name in db._field_db_names])
+    return db._fetch(dumped_key)
+
+
+def _decode(db, dumped_key, raw):
+    if db._fields is not None:
+        return db._load_record(dumped_key)
+    return db._value_loads(raw)
+
+
+def _export_folder(args):
+    segment, out_dir = args
+    db = _worker_dbs()[0]
+    n = n_bytes = 0
+    for k, raw in _iter_segment(db, segment):
+        value = _decode(db, k, raw)
+        if not isinstance(value, bytes):
+            value = pickle.dumps(value)
+        key = db._key_loads(k)
+        path = os.path.realpath(os.path.join(out_dir, str(key)))
+        if os.path.commonpath([out_dir, path]) != out_dir:
+            raise ValueError(f'{key!r} would be exported outside of {out_dir}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(value)
+        n += 1
+        n_bytes += len(value)
+    return dict(records=n, bytes=n_bytes)
+
+
+def _export_tar(args):
+    index, segment, out_dir = args
+    db = _worker_dbs()[0]
+    n = n_bytes = 0
+    with tarfile.open(os.path.join(out_dir, f'part-{index:05d}.tar'), 'w') as tar:
+        for k, raw in _iter_segment(db, segment):
+            value = _decode(db, k, raw)
+            if not isinstance(value, bytes):
+                value = pickle.dumps(value)
+            info = tarfile.TarInfo(str(db._key_loads(k)))
+            info.size = len(value)
+            tar.addfile(info, io.BytesIO(value))
+            n += 1
+            n_bytes += len(value)
+    return dict(records=n, bytes=n_bytes)
+
+
+def _checksum(segment):
+    db = _worker_dbs()[0]
+    digests = []
+    n_bytes = 0
+    for k, raw in _iter_segment(db, segment):
+        digests.append((db._key_loads(k), hashlib.blake2b(raw, digest_size=16).hexdigest()))
+        n_bytes += len(raw)
+    return dict(records=len(digests), bytes=n_bytes, digests=digests)
+
+
+def _compare(args):
+    segment, max_report = args
+    db_a, db_b = _worker_dbs()
+    a = _iter_segment(db_a, segment)
+    b = _iter_segment(db_b, segment)
+    only_a, only_b, different = [], [], []
+    n = n_bytes = 0
+    item_a, item_b = next(a, None), next(b, None)
+    while item_a is not None or item_b is not None:
+        n += 1
+        if item_b is None or (item_a is not None and item_a[0] < item_b[0]):
+            only_a.append(item_a[0])
+            n_bytes += len(item_a[1])
+            item_a = next(a, None)
+        elif item_a is None or item_b[0] < item_a[0]:
+            only_b.append(item_b[0])
+            n_bytes += len(item_b[1])
+            item_b = next(b, None)
+        else:
+            if item_a[1] != item_b[1]:
+                different.append(item_a[0])
+            n_bytes += len(item_a[1]) + len(item_b[1])
+            item_a, item_b = next(a, None), next(b, None)
+    # Only send back max_report keys of each kind to bound the memory
+    return dict(
+        records=n, bytes=n_bytes,
+        n_only_a=len(only_a), n_only_b=len(only_b), n_different=len(different),
+        only_a=[db_a._key_loads(k) for k in only_a[:max_report]],
+        only_b=[db_b._key_loads(k) for k in only_b[:max_report]],
+        different=[db_a._key_loads(k) for k in different[:max_report]],
+    )
+
+
+def _run(lmdb_paths, fn, tasks, num_workers):
+    """
+    Run fn over the tasks in a process pool, yielding the results in order
+    as they come. Each worker opens the lmdbdicts once. At most two tasks
+    per worker are in flight, so finished results don't pile up when
+    they are consumed slower than produced.
+    """
+    with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(lmdb_paths,)) as pool:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(fn, (task,)))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def _throughput(stats, start):
+    stats['seconds'] = time.perf_counter() - start
+    stats['records_per_sec'] = stats['records'] / stats['seconds']
+    stats['mb_per_sec'] = stats['bytes'] / stats['seconds'] / 2 ** 20
+    return stats
+
+
+def _sum(results, keys=('records', 'bytes')):
+    stats = dict.fromkeys(keys, 0)
+    for result in results:
+        for k in keys:
+            stats[k] += result[k]
+    return stats
+
+
+def _defaults(num_workers, num_segments):
+    num_workers = num_workers or os.cpu_count()
+    # Many small segments balance the workers, see segments for their size
+    return num_workers, num_segments or 16 * num_workers
+
+
+def export_folder(lmdb_path, out_dir, num_workers=None, num_segments=None):
+    """
+    Write each value into out_dir/str(key), like the input of folder2lmdb.py.
+    Values that are not bytes are pickled.
+    """
+    num_workers, num_segments = _defaults(num_workers, num_segments)
+    start = time.perf_counter()
+    out_dir = os.path.realpath(out_dir)
+    tasks = [(segment, out_dir) for segment in _segments(lmdb_path, num_segments)]
+    return _throughput(_sum(_run([lmdb_path], _export_folder, tasks, num_workers)), start)
+
+
+def export_tar(lmdb_path, out_dir, num_workers=None, num_segments=None):
+    """
+    Write the values into the tar files out_dir/part-*.tar, one per segment,
+    with str(key) as the member names. Values that are not bytes are pickled.
+    """
+    num_workers, num_segments = _defaults(num_workers, num_segments)
+    start = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(i, segment, out_dir) for i, segment in enumerate(_segments(lmdb_path, num_segments))]
+    return _throughput(_sum(_run([lmdb_path], _export_tar, tasks, num_workers)), start)
+
+
+class _SegmentItems(object):
+    # Picklable item_fn of parallel_build, decodes the items of a segment.
+    # Only the path is pickled, the lmdbdict is opened once per worker.
+    def __init__(self, lmdb_path):
+        self.lmdb_path = lmdb_path
+
+    def __call__(self, segment):
+        if _dbs is None and _init_error is None:
+            _init_worker([self.lmdb_path])
+        db = _worker_dbs()[0]
+        for k, raw in _iter_segment(db, segment):
+            yield db._key_loads(k), _decode(db, k, raw)
+
+
+def convert(lmdb_path, out_path, num_workers=None, num_segments=None, **kwargs):
+    """
+    Re-encode the lmdbdict into a new one at out_path with the key/value
+    methods in kwargs, decoding and encoding in parallel with parallel_build.
+    The keys of the new lmdbdict are in the order of the encoded source keys.
+    The returned bytes are the encoded bytes written to out_path.
+    """
+    num_workers, num_segments = _defaults(num_workers, num_segments)
+    start = time.perf_counter()
+    tasks = _segments(lmdb_path, num_segments)
+    # The number of staging parts is left to parallel_build
+    stats = parallel_build(out_path, tasks, _SegmentItems(lmdb_path),
+                           num_workers=num_workers, **kwargs)
+    return _throughput(stats, start)
+
+
+def checksum(lmdb_path, out=None, num_workers=None, num_segments=None):
+    """
+    Checksum each encoded value. If out is a text file, one 'key<TAB>digest'
+    line is streamed into it per record. The returned 'digest' summarizes
+    all the records, so two stores can be compared by it.
+    """
+    num_workers, num_segments = _defaults(num_workers, num_segments)
+    start = time.perf_counter()
+    tasks = _segments(lmdb_path, num_segments)
+    total = hashlib.blake2b(digest_size=16)
+    stats = dict(records=0, bytes=0)
+    for result in _run([lmdb_path], _checksum, tasks, num_workers):
+        for key, digest in result['digests']:
+            total.update(repr(key).encode('utf8') + digest.encode('ascii'))
+            if out is not None:
+                out.write(f'{key}\t{digest}\n')
+        stats['records'] += result['records']
+        stats['bytes'] += result['bytes']
+    stats['digest'] = total.hexdigest()
+    return _throughput(stats, start)
+
+
+def compare(lmdb_path_a, lmdb_path_b, num_workers=None, num_segments=None, max_report=100):
+    """
+    Compare the encoded keys and values of two lmdbdicts, which need to
+    use the same key/value methods. Return the counts of keys only in a,
+    only in b, or with different values, and up to max_report of each.
+    """
+    num_workers, num_segments = _defaults(num_workers, num_segments)
+    start = time.perf_counter()
+    tasks = [(segment, max_report) for segment in _segments(lmdb_path_a, num_segments)]
+    stats = dict(records=0, bytes=0, n_only_a=0, n_only_b=0, n_different=0,
+                 only_a=[], only_b=[], different=[])
+    for result in _run([lmdb_path_a, lmdb_path_b], _compare, tasks, num_workers):
+        for k in ['records', 'bytes', 'n_only_a', 'n_only_b', 'n_different']:
+            stats[k] += result[k]
+        for k in ['only_a', 'only_b', 'different']:
+            stats[k] += result[k][:max_report - len(stats[k])]
+    stats['same'] = stats['n_only_a'] == stats['n_only_b'] == stats['n_different'] == 0
+    return _throughput(stats, start)
+
+
+def main():
+    import sys
+    import json
+    import argparse
+    parser = argparse.ArgumentParser(description='Export, convert, checksum or compare lmdbdicts in parallel.')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--segments', type=int, default=None)
+    subparsers = parser.add_subparsers(dest='command')
+    p = subparsers.add_parser('folder', help='export to a folder')
+    p.add_argument('lmdb')
+    p.add_argument('out_dir')
+    p = subparsers.add_parser('tar', help='export to tar files')
+    p.add_argument('lmdb')
+    p.add_argument('out_dir')
+    p = subparsers.add_parser('convert', help='re-encode with other key/value methods')
+    p.add_argument('lmdb')
+    p.add_argument('out')
+    p.add_argument('--key-method', type=str, default=None)
+    p.add_argument('--value-method', type=str, default=None)
+    p = subparsers.add_parser('checksum', help='checksum each record')
+    p.add_argument('lmdb')
+    p.add_argument('-o', '--output', type=str, default=None,
+                   help='where to write the per record checksums, - for stdout')
+    p = subparsers.add_parser('compare', help='compare two lmdbdicts')
+    p.add_argument('lmdb_a')
+    p.add_argument('lmdb_b')
+    args = parser.parse_args()
+
+    kwargs = dict(num_workers=args.workers, num_segments=args.segments)
+    if args.command == 'folder':
+        stats = export_folder(args.lmdb, args.out_dir, **kwargs)
+    elif args.command == 'tar':
+        stats = export_tar(args.lmdb, args.out_dir, **kwargs)
+    elif args.command == 'convert':
+        stats = convert(args.lmdb, args.out, key_method=args.key_method,
+                        value_method=args.value_method, **kwargs)
+    elif args.command == 'checksum':
+        if args.output == '-':
+            stats = checksum(args.lmdb, out=sys.stdout, **kwargs)
+        elif args.output is not None:
+            with open(args.output, 'w') as f:
+                stats = checksum(args.lmdb, out=f, **kwargs)
+        else:
+            stats = checksum(args.lmdb, **kwargs)
+    elif args.command == 'compare':
+        stats = compare(args.lmdb_a, args.lmdb_b, **kwargs)
+    else:
+        parser.print_help()
+        return
+    print(json.dumps(stats, default=repr), file=sys.stderr if args.command == 'checksum' else sys.stdout)
+    if args.command == 'compare' and not stats['same']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
 import lmdb
 import pickle
 import os
-from .utils import PicklableWrapper, picklable_wrapper
+import io
+import struct
+import hashlib
+from .utils import PicklableWrapper, picklable_wrapper, unwrap
 from .methods import DUMPS_FUNC, LOADS_FUNC
+from .stats import Stats, now
 
 RESERVED = [
     b'__keys__',
@@ -10,15 +14,120 @@ RESERVED = [
     b'__value_dumps__',
     b'__key_loads__',
     b'__value_loads__',
+    b'__chunks__',
+    b'__chunk_db__',
+    b'__dedup__',
+    b'__dedup_db__',
+    b'__dedup_refs__',
+    b'__fields__',
 ]
 
+# Names of the sub databases
+# pieces of chunked values
+CHUNK_DB = b'__chunk_db__'
+# content hash -> encoded value, for dedup mode
+DEDUP_DB = b'__dedup_db__'
+# content hash -> (reference count, encoded length), for dedup mode
+DEDUP_REFS = b'__dedup_refs__'
+# one sub db per field, for record mode
+FIELD_DB_PREFIX = b'__field__:'
+# 3 internal sub dbs + up to 125 fields
+MAX_DBS = 128
+
+_REF = struct.Struct('>QQ')
+
+
+def _content_hash(value):
+    return hashlib.blake2b(value, digest_size=32).digest()
+
+
+def _field_db_name(field):
+    return FIELD_DB_PREFIX + field.encode('utf8')
+
+
+def _resolve_dumps_loads(dumps, loads, which='value'):
+    """
+    Turn the dumps and loads (None, method names or functions)
+    into functions.
+    """
+    if dumps is None or loads is None:
+        assert dumps == loads, f'The {which}_dumps and {which}_loads have to be both None'
+        return pickle.dumps, pickle.loads
+    elif type(dumps) is str and type(loads) is str:
+        assert dumps == loads, f'The {which}_dumps and {which}_loads have to correspondant'
+        return DUMPS_FUNC[dumps], LOADS_FUNC[loads]
+    else:  # have to be function
+        return dumps, loads
+
+
+def _rewrap(obj):
+    if isinstance(obj, tuple):
+        return tuple(map(_rewrap, obj))
+    elif isinstance(obj, dict):
+        return {k: _rewrap(v) for k, v in obj.items()}
+    return picklable_wrapper(obj) if callable(obj) else obj
+
+
+def _chunk_key(dumped_key, index):
+    # The index suffix has a fixed width so that chunk keys of two
+    # different dumped keys can never collide.
+    return dumped_key + struct.pack('>I', index)
+
+
+class ChunkedValueReader(io.RawIOBase):
+    """
+    A read-only, seekable raw stream over the encoded bytes of a value.
+    Only the chunks covering the requested range are fetched.
+    Use lmdbdict.open(key) instead of instantiating it directly.
+    """
+
+    def __init__(self, db, key):
+        self._db = db
+        self._key = key
+        self._size = db.value_size(key)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f'invalid whence ({whence})')
+        if pos < 0:
+            raise ValueError(f'negative seek position {pos}')
+        self._pos = pos
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        data = self._db.read_range(self._key, self._pos, len(b))
+        n = len(data)
+        b[:n] = data
+        self._pos += n
+        return n
+
 class lmdbdict:
     def __init__(self, lmdb_path, mode='r',
                  key_method=None, value_method=None,
                  key_dumps=None, key_loads=None,
                  value_dumps=None, value_loads=None,
                  unsafe=False,
-                 readahead=False):
+                 readahead=False,
+                 chunk_size=None,
+                 dedup=None,
+                 fields=None,
+                 instrument=False):
         """
         Args:
         value/key_dumps/loads: can be picklable functions
@@ -29,10 +138,33 @@ class lmdbdict:
         unsafe: if True, you can getitem by the key even the key is not
         in the self._keys.
         readahead: for lmdb reader, only make sense when mode='r'
+        chunk_size: only make sense when mode='w'. If not None, encoded
+        values longer than chunk_size bytes are split into chunks of
+        chunk_size bytes, so that read_range and open only fetch the
+        chunks they need.
+        dedup: if True, identical values are stored once under their
+        content hash, and keys point to the hash. Can only be set when
+        creating the lmdb; if None, use what's saved in the db.
+        fields: record mode. A dict from field name to its value method
+        (same options as value_method) or a (dumps, loads) tuple.
+        Values have to be dicts of these fields, and each field is stored
+        in its own sub db, so get(key, fields=[...]) only reads and
+        decodes the requested fields. Can only be set when creating
+        the lmdb; if None, use what's saved in the db.
+        instrument: if True, count and time the key check, key encode,
+        fetch and decode of __getitem__, the encode of __setitem__, and
+        flush and commit. See stats and add_stats_hook.
         """
         self.lmdb_path = lmdb_path
         self.mode = mode
         self.readahead = readahead
+        assert chunk_size is None or mode == 'w', 'chunk_size only make sense in write mode'
+        assert chunk_size is None or chunk_size > 0, 'chunk_size has to be positive'
+        self.chunk_size = chunk_size
+        self._stats = Stats() if instrument else None
+        # attribute name -> its picklable version, for the attributes holding
+        # unwrapped functions, see __getstate__
+        self._picklable = {}
         self._init_db()
         if self.db_txn.get(b'__keys__'):
             try:
@@ -51,6 +183,20 @@ class lmdbdict:
         if type(self._keys) is set:
             self._keys = sorted(list(self._keys), key=lambda x:pickle.dumps(x))
 
+        # dumped key -> (total length, chunk size) of the chunked values
+        if self.db_txn.get(b'__chunks__'):
+            self._chunks = pickle.loads(self.db_txn.get(b'__chunks__'))
+        else:
+            self._chunks = {}
+
+        self._init_dedup(dedup)
+        assert not (self._dedup and self.chunk_size is not None), \
+            'chunk_size is not supported together with dedup'
+        self._init_fields(fields)
+        assert self._fields is None or not (self._dedup or self.chunk_size is not None), \
+            'fields is not supported together with dedup or chunk_size'
+        self._update_fast_path()
+
         self._init_dumps_loads(value_method, value_dumps, value_loads, which='value')
         self._init_dumps_loads(key_method, key_dumps, key_loads, which='key')
 
@@ -105,17 +251,118 @@ class lmdbdict:
                 f'cannot set the {which}_dumps and {which}_loads under read mode'
             print(f"No {which} dumps and loads found in lmdb, will use pickle")
 
-        if dumps is None or loads is None:
-            assert dumps == loads, f'The {which}_dumps and {which}_loads have to be both None'
-            setattr(self, f'_{which}_dumps', pickle.dumps)
-            setattr(self, f'_{which}_loads', pickle.loads)
-        elif type(dumps) is str and type(loads) is str:
-            assert dumps == loads, f'The {which}_dumps and {which}_loads have to correspondant'
-            setattr(self, f'_{which}_dumps', DUMPS_FUNC[dumps])
-            setattr(self, f'_{which}_loads', LOADS_FUNC[loads])
-        else:  # have to be function
-            setattr(self, f'_{which}_dumps', dumps)
-            setattr(self, f'_{which}_loads', loads)
+        dumps, loads = _resolve_dumps_loads(dumps, loads, which)
+        self._set_unwrapped(f'_{which}_dumps', dumps)
+        self._set_unwrapped(f'_{which}_loads', loads)
+
+    def _set_unwrapped(self, name, value):
+        """
+        Set the attribute to the value with the PicklableWrappers removed,
+        so that the hot path calls the functions directly. The wrapped
+        value is kept for pickling.
+        """
+        unwrapped = unwrap(value)
+        if unwrapped is not value:
+            self._picklable[name] = value
+        setattr(self, name, unwrapped)
+
+    def _init_fields(self, fields):
+        """
+        Initialize the record fields and their dumps loads functions
+        according to the user input or the db.
+        """
+        if fields is not None:
+            specs = {}
+            for name, method in fields.items():
+                dumps, loads = method if isinstance(method, tuple) else (method, method)
+                # Make them picklable, same as _init_dumps_loads
+                if callable(dumps) and callable(loads):
+                    dumps = PicklableWrapper(dumps)
+                    loads = PicklableWrapper(loads)
+                specs[name] = (dumps, loads)
+            fields = specs
+        if self.db_txn.get(b'__fields__') is not None:
+            assert fields is None, 'fields have to be None when read from a non-empty lmdb'
+            fields = pickle.loads(self.db_txn.get(b'__fields__'))
+            # Make them multiprocessing forkable
+            fields = {name: (PicklableWrapper(dumps), PicklableWrapper(loads))
+                      if callable(dumps) and callable(loads) else (dumps, loads)
+                      for name, (dumps, loads) in fields.items()}
+        elif fields is not None:
+            assert self.mode == 'w', 'cannot set the fields under read mode'
+            assert len(self._keys) == 0, 'fields can only be set on an empty lmdb'
+            self.db_txn.put(b'__fields__', pickle.dumps(fields))
+            # Create the sub dbs now, so readers can open all of them
+            for name in fields:
+                self._get_sub_db(_field_db_name(name))
+            self.db_txn.commit()
+            self.db_txn = self.env.begin(write=True)
+        if fields is None:
+            self._fields = None
+            self._field_db_names = ()
+        else:
+            self._set_unwrapped('_fields', {name: _resolve_dumps_loads(*methods, which=name)
+                                            for name, methods in fields.items()})
+            self._field_db_names = [_field_db_name(name) for name in self._fields]
+
+    def _init_dedup(self, dedup):
+        """
+        Initialize the dedup mode according to the user input or the db.
+        """
+        saved_dedup = self.db_txn.get(b'__dedup__')
+        if saved_dedup is not None:
+            saved_dedup = pickle.loads(saved_dedup)
+            assert dedup is None or dedup == saved_dedup, \
+                'dedup has to be None or the same as what\'s saved in the lmdb'
+            dedup = saved_dedup
+        elif self.mode == 'w' and dedup:
+            assert len(self._keys) == 0, 'dedup can only be enabled on an empty lmdb'
+            self.db_txn.put(b'__dedup__', pickle.dumps(True))
+            self.db_txn.commit()
+            self.db_txn = self.env.begin(write=True)
+        self._dedup = bool(dedup)
+
+    def _incref(self, digest, value):
+        refs_db = self._get_sub_db(DEDUP_REFS)
+        ref = self.db_txn.get(digest, db=refs_db)
+        if ref is None:
+            self.db_txn.put(digest, value, db=self._get_sub_db(DEDUP_DB))
+            count = 0
+        else:
+            count, _ = _REF.unpack(ref)
+        self.db_txn.put(digest, _REF.pack(count + 1, len(value)), db=refs_db)
+
+    def _decref(self, digest):
+        refs_db = self._get_sub_db(DEDUP_REFS)
+        count, size = _REF.unpack(self.db_txn.get(digest, db=refs_db))
+        if count > 1:
+            self.db_txn.put(digest, _REF.pack(count - 1, size), db=refs_db)
+        else:
+            self.db_txn.delete(digest, db=refs_db)
+            self.db_txn.delete(digest, db=self._get_sub_db(DEDUP_DB))
+
+    def dedup_stats(self):
+        """
+        Return the statistics of the deduplication: number of references
+        and unique values, their total encoded bytes, and the ratio
+        between the two (>= 1, the higher the more space saved).
+        """
+        assert self._dedup, 'dedup_stats only make sense in dedup mode'
+        n_refs = n_unique = logical_bytes = stored_bytes = 0
+        if self.db_txn.get(DEDUP_REFS) is not None:
+            for _, ref in self.db_txn.cursor(db=self._get_sub_db(DEDUP_REFS)):
+                count, size = _REF.unpack(ref)
+                n_refs += count
+                n_unique += 1
+                logical_bytes += count * size
+                stored_bytes += size
+        return dict(
+            n_refs=n_refs,
+            n_unique=n_unique,
+            logical_bytes=logical_bytes,
+            stored_bytes=stored_bytes,
+            dedup_ratio=logical_bytes / stored_bytes if stored_bytes else 1.0,
+        )
 
     def keys(self):
         return self._keys
@@ -127,55 +374,427 @@ class lmdbdict:
         r"""
         Make it pickable
         """
-        state = self.__dict__
+        state = self.__dict__.copy()
         state["env"] = None
         state["db_txn"] = None
+        state["_sub_dbs"] = None
+        # Send the wrapped functions, their dumps are cached in the wrappers
+        state.update(self._picklable)
         return state
 
     def __setstate__(self, state):
         self.__dict__ = state
+        # The wrappers are loaded back as the plain functions,
+        # wrap them again in case this lmdbdict is pickled again
+        self._picklable = {name: _rewrap(value) for name, value in self._picklable.items()}
         self._init_db()
 
     def _init_db(self):
+        # The sub dbs are opened lazily, see _get_sub_db
+        self._sub_dbs = {}
         if self.mode == 'r':
             self.env = lmdb.open(
                 self.lmdb_path,
                 subdir=os.path.isdir(self.lmdb_path),
                 readonly=self.readahead, lock=False,
                 readahead=False, map_size=1099511627776 * 2,
-                max_readers=100,
+                max_readers=100, max_dbs=MAX_DBS,
             )
             self.db_txn = self.env.begin(write=False)
         elif self.mode == 'w':
             self.env = lmdb.open(
                 self.lmdb_path, subdir=False,
                 readonly=False, map_size=1099511627776 * 2,
-                meminit=False, map_async=True)
+                meminit=False, map_async=True, max_dbs=MAX_DBS)
             self.db_txn = self.env.begin(write=True)
 
-    def __getitem__(self, key):
+    def _get_sub_db(self, name):
+        """
+        Open the sub db of name. It's only created when it's first written,
+        so stores not using chunks or dedup are unchanged.
+        """
+        if name not in self._sub_dbs:
+            self._sub_dbs[name] = self.env.open_db(
+                name, txn=self.db_txn, create=self.mode == 'w')
+        return self._sub_dbs[name]
+
+    def _read_chunks(self, dumped_key, offset=0, length=None):
+        """
+        Read length bytes starting from offset of a chunked value.
+        """
+        size, chunk_size = self._chunks[dumped_key]
+        end = size if length is None else min(size, offset + length)
+        if offset >= end:
+            return b''
+        chunk_db = self._get_sub_db(CHUNK_DB)
+        pieces = []
+        for i in range(offset // chunk_size, (end - 1) // chunk_size + 1):
+            chunk = self.db_txn.get(_chunk_key(dumped_key, i), db=chunk_db)
+            start = max(offset - i * chunk_size, 0)
+            stop = min(end - i * chunk_size, chunk_size)
+            pieces.append(chunk[start:stop])
+        return b''.join(pieces)
+
+    def _delete_chunks(self, dumped_key):
+        size, chunk_size = self._chunks.pop(dumped_key)
+        self._update_fast_path()
+        chunk_db = self._get_sub_db(CHUNK_DB)
+        for i in range((size + chunk_size - 1) // chunk_size):
+            self.db_txn.delete(_chunk_key(dumped_key, i), db=chunk_db)
+
+    def _get_raw(self, key):
+        """
+        Get the encoded value of key, None if not found
+        """
         if not self.unsafe:
             # Under safe mode, the key has to be in the self._keys
             if not key in self:
                 raise KeyError
-        tmp = self.db_txn.get(self._key_dumps(key))
+        return self._fetch(self._key_dumps(key))
+
+    def _fetch(self, dumped_key):
+        """
+        Get the encoded value of dumped_key, None if not found
+        """
+        if self._chunks and dumped_key in self._chunks:
+            return self._read_chunks(dumped_key)
+        tmp = self.db_txn.get(dumped_key)
+        if self._dedup and tmp is not None:
+            tmp = self.db_txn.get(tmp, db=self._get_sub_db(DEDUP_DB))
+        return tmp
+
+    def _load_record(self, dumped_key, fields=None):
+        """
+        Read and decode the given fields (all if None) of a record.
+        Fields missing in the record are left out.
+        """
+        record = {}
+        for field in self._fields if fields is None else fields:
+            tmp = self.db_txn.get(dumped_key, db=self._get_sub_db(_field_db_name(field)))
+            if tmp is not None:
+                record[field] = self._fields[field][1](tmp)
+        return record
+
+    def _update_fast_path(self):
+        # When no value is chunked, deduplicated or split into fields, and
+        # the lmdbdict is not instrumented, __getitem__ reads the value
+        # directly from the main db
+        self._fast_path = (not self._chunks and not self._dedup
+                           and self._fields is None and self._stats is None)
+
+    def __getitem__(self, key):
+        if self._fast_path:
+            if not self.unsafe:
+                # Under safe mode, the key has to be in the self._keys
+                if not key in self:
+                    raise KeyError
+            tmp = self.db_txn.get(self._key_dumps(key))
+        elif self._stats is not None:
+            return self._getitem_instrumented(key)
+        elif self._fields is not None:
+            return self.get_fields(key)
+        else:
+            tmp = self._get_raw(key)
         if tmp is None:
             raise KeyError
         else:
             return self._value_loads(tmp)
 
+    def _getitem_instrumented(self, key):
+        # Same as __getitem__, but records the time of each step
+        stats = self._stats
+        start = now()
+        if not self.unsafe and not key in self:
+            stats.record('key_check', now() - start)
+            raise KeyError
+        t_check = now()
+        stats.record('key_check', t_check - start)
+        dumped_key = self._key_dumps(key)
+        t_encode = now()
+        stats.record('key_encode', t_encode - t_check)
+        if self._fields is not None:
+            # Fields are fetched and decoded one after another
+            if self.db_txn.get(dumped_key) is None:
+                raise KeyError
+            value = self._load_record(dumped_key)
+            stats.record('fetch_decode', now() - t_encode)
+        else:
+            tmp = self._fetch(dumped_key)
+            t_fetch = now()
+            stats.record('fetch', t_fetch - t_encode, 0 if tmp is None else len(tmp))
+            if tmp is None:
+                raise KeyError
+            value = self._value_loads(tmp)
+            stats.record('decode', now() - t_fetch)
+        stats.record('getitem', now() - start)
+        return value
+
+    def stats(self, reset=False):
+        """
+        Return env.stat() and env.info() of the lmdb, the number of keys,
+        and, if instrument=True, the per operation stats under 'ops'.
+        If reset, the per operation stats are cleared afterwards.
+        """
+        out = dict(self.env.stat())
+        out.update(self.env.info())
+        out['len'] = len(self)
+        if self._stats is not None:
+            out['ops'] = self._stats.to_dict()
+            if reset:
+                self._stats.reset()
+        return out
+
+    def add_stats_hook(self, hook):
+        """
+        hook(op, seconds, n_bytes) is called after each recorded operation,
+        e.g. to export them to a metrics system. Needs instrument=True.
+        """
+        assert self._stats is not None, 'stats hooks need instrument=True'
+        self._stats.add_hook(hook)
+
+    def warmup(self, keys=None, method='read', num_threads=8):
+        """
+        Pull the lmdb into the page cache, so the first epoch doesn't pay
+        the disk reads. Return the number of bytes touched.
+        keys: if not None, only the values of these keys are read, in the
+        order they are stored.
+        method: for the whole file, 'read' reads it with num_threads
+        parallel sequential readers; 'madvise' asks the kernel to read it
+        in the background and returns immediately. For keys, the values are
+        read by num_threads parallel readers with both methods, since the
+        pages of a value can't be advised on their own. In write mode they
+        are read by a single reader, to see the unflushed writes.
+        """
+        if method not in ['read', 'madvise']:
+            raise ValueError(f'unknown warmup method {method}')
+        if keys is None:
+            # Imported here so that python -m lmdbdict.warmup runs cleanly
+            from . import warmup as _warmup
+            path = _warmup.data_file(self.lmdb_path)
+            if method == 'read':
+                return _warmup.read_file(path, num_threads=num_threads)
+            return _warmup.madvise_willneed(path)
+        from concurrent.futures import ThreadPoolExecutor
+        dumped_keys = sorted(map(self._key_dumps, keys))
+
+        def read(txn, sub_dbs, dumped_keys):
+            n_bytes = 0
+            for dumped_key in dumped_keys:
+                if self._fields is not None:
+                    raw = [txn.get(dumped_key, db=sub_dbs[name]) for name in self._field_db_names]
+                elif self._chunks and dumped_key in self._chunks:
+                    size, chunk_size = self._chunks[dumped_key]
+                    raw = [txn.get(_chunk_key(dumped_key, i), db=sub_dbs[CHUNK_DB])
+                           for i in range((size + chunk_size - 1) // chunk_size)]
+                else:
+                    tmp = txn.get(dumped_key)
+                    if self._dedup and tmp is not None:
+                        tmp = txn.get(tmp, db=sub_dbs[DEDUP_DB])
+                    raw = [tmp]
+                n_bytes += sum(len(tmp) for tmp in raw if tmp is not None)
+            return n_bytes
+
+        names = list(self._field_db_names)
+        if self._dedup:
+            names.append(DEDUP_DB)
+        if self._chunks:
+            names.append(CHUNK_DB)
+        if self.mode == 'w':
+            # The unflushed writes are only visible to the write transaction
+            return read(self.db_txn, {name: self._get_sub_db(name) for name in names}, dumped_keys)
+        # The sub dbs opened in self.db_txn are private to it, so the readers
+        # use handles opened outside of any transaction
+        sub_dbs = {name: self.env.open_db(name, create=False) for name in names}
+
+        def read_range(i):
+            # Each reader has its own transaction, and reads a contiguous
+            # range of the sorted keys
+            with self.env.begin(write=False) as txn:
+                return read(txn, sub_dbs, dumped_keys[len(dumped_keys) * i // num_threads:
+                                                      len(dumped_keys) * (i + 1) // num_threads])
+        with ThreadPoolExecutor(num_threads) as pool:
+            return sum(pool.map(read_range, range(num_threads)))
+
+    def residency(self):
+        """
+        Return how much of the data file is in the page cache:
+        file_bytes, resident_bytes and resident_fraction.
+        """
+        from . import warmup as _warmup
+        return _warmup.residency(_warmup.data_file(self.lmdb_path))
+
+    def get_fields(self, key, fields=None):
+        """
+        Record mode only. Return the record of key with only the given
+        fields (all if None); the other fields are neither read nor decoded.
+        """
+        assert self._fields is not None, 'get_fields only make sense in record mode'
+        if fields is not None:
+            for field in fields:
+                assert field in self._fields, f'{field} is not a field of this lmdb'
+        if self._get_raw(key) is None:
+            raise KeyError
+        return self._load_record(self._key_dumps(key), fields)
+
+    def get(self, key, default=None, fields=None):
+        """
+        Like dict.get. In record mode, fields selects which fields to read.
+        """
+        try:
+            if fields is not None:
+                return self.get_fields(key, fields)
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_batch(self, keys, fields=None):
+        """
+        Return the values of keys as a list. In record mode, fields selects
+        which fields to read, and they are read one field at a time so that
+        each field's sub db is scanned contiguously.
+        """
+        if self._fields is None:
+            assert fields is None, 'fields only make sense in record mode'
+            return [self[key] for key in keys]
+        fields = list(self._fields) if fields is None else fields
+        for field in fields:
+            assert field in self._fields, f'{field} is not a field of this lmdb'
+        dumped_keys = []
+        for key in keys:
+            if self._get_raw(key) is None:
+                raise KeyError
+            dumped_keys.append(self._key_dumps(key))
+        records = [{} for _ in dumped_keys]
+        for field in fields:
+            field_db = self._get_sub_db(_field_db_name(field))
+            field_loads = self._fields[field][1]
+            for record, dumped_key in zip(records, dumped_keys):
+                tmp = self.db_txn.get(dumped_key, db=field_db)
+                if tmp is not None:
+                    record[field] = field_loads(tmp)
+        return records
+
+    def value_size(self, key):
+        """
+        Return the length of the encoded value of key in bytes.
+        """
+        dumped_key = self._key_dumps(key)
+        if self._chunks and dumped_key in self._chunks:
+            if not self.unsafe and not key in self:
+                raise KeyError
+            return self._chunks[dumped_key][0]
+        tmp = self._get_raw(key)
+        if tmp is None:
+            raise KeyError
+        return len(tmp)
+
+    def read_range(self, key, offset, length=None):
+        """
+        Read length bytes (till the end if None) of the encoded value of key,
+        starting from offset. Note the range is on the output of value_dumps,
+        so it is mostly useful with value_method='identity'.
+        For chunked values, only the chunks covering the range are read.
+        """
+        assert offset >= 0, 'offset has to be non-negative'
+        dumped_key = self._key_dumps(key)
+        if self._chunks and dumped_key in self._chunks:
+            if not self.unsafe and not key in self:
+                raise KeyError
+            return self._read_chunks(dumped_key, offset, length)
+        tmp = self._get_raw(key)
+        if tmp is None:
+            raise KeyError
+        return tmp[offset:] if length is None else tmp[offset:offset + length]
+
+    def open(self, key, buffering=io.DEFAULT_BUFFER_SIZE):
+        """
+        Return a read-only, seekable file-like object over the encoded
+        value of key. Set buffering to 0 to get the unbuffered raw stream
+        of a chunked value. Values that are not chunked are read once into
+        a BytesIO.
+        """
+        if not (self._chunks and self._key_dumps(key) in self._chunks):
+            tmp = self._get_raw(key)
+            if tmp is None:
+                raise KeyError
+            return io.BytesIO(tmp)
+        raw = ChunkedValueReader(self, key)
+        if buffering == 0:
+            return raw
+        return io.BufferedReader(raw, buffer_size=buffering)
+
     def __setitem__(self, key, value):
         assert self.mode == 'w', 'can only write item in write mode'
         # in fact even key is __len__ it should be fine, because it's dumped in pickle mode.
         assert key not in ['__keys__'], \
             f'{key} is internal variable, immutable to users'
-        self.db_txn.put(self._key_dumps(key), self._value_dumps(value))
+        stats = self._stats
+        if stats is not None:
+            start = now()
+        dumped_key = self._key_dumps(key)
+        if self._fields is not None:
+            self._put_record(dumped_key, value)
+            self._keys.append(key)  # only update to the lmdb after flush
+            if stats is not None:
+                stats.record('setitem', now() - start)
+            return
+        dumped_value = self._value_dumps(value)
+        n_bytes = len(dumped_value)
+        if stats is not None:
+            stats.record('encode', now() - start, n_bytes)
+        if self._chunks and dumped_key in self._chunks:
+            self._delete_chunks(dumped_key)
+        if self.chunk_size is not None and len(dumped_value) > self.chunk_size:
+            chunk_db = self._get_sub_db(CHUNK_DB)
+            view = memoryview(dumped_value)
+            for i, offset in enumerate(range(0, len(view), self.chunk_size)):
+                self.db_txn.put(_chunk_key(dumped_key, i),
+                                view[offset:offset + self.chunk_size], db=chunk_db)
+            self._chunks[dumped_key] = (len(dumped_value), self.chunk_size)
+            self._update_fast_path()
+            # Keep a placeholder so that the key still shows up in sequential_iter
+            dumped_value = b''
+        elif self._dedup:
+            digest = _content_hash(dumped_value)
+            self._incref(digest, dumped_value)
+            old_digest = self.db_txn.get(dumped_key)
+            if old_digest is not None:
+                self._decref(old_digest)
+            dumped_value = digest
+        self.db_txn.put(dumped_key, dumped_value)
         self._keys.append(key)  # only update to the lmdb after flush
+        if stats is not None:
+            stats.record('setitem', now() - start, n_bytes)
+
+    def _put_record(self, dumped_key, value):
+        assert isinstance(value, dict), 'values have to be dicts in record mode'
+        for field in value:
+            assert field in self._fields, f'{field} is not a field of this lmdb'
+        for field, (field_dumps, _) in self._fields.items():
+            field_db = self._get_sub_db(_field_db_name(field))
+            if field in value:
+                self.db_txn.put(dumped_key, field_dumps(value[field]), db=field_db)
+            else:
+                # Remove the stale field when overwriting a record
+                self.db_txn.delete(dumped_key, db=field_db)
+        # Keep a placeholder so that the key still shows up in sequential_iter
+        self.db_txn.put(dumped_key, b'')
 
     def __delitem__(self, key):
         assert self.mode == 'w', 'can only write item in write mode'
         assert key in self._keys, f'{key} not in this lmdb'
-        self.db_txn.delete(self._key_dumps(key))
+        dumped_key = self._key_dumps(key)
+        if self._chunks and dumped_key in self._chunks:
+            self._delete_chunks(dumped_key)
+        if self._dedup:
+            # The key can be in self._keys without a stored record
+            digest = self.db_txn.get(dumped_key)
+            if digest is not None:
+                self._decref(digest)
+        if self._fields is not None:
+            for field_db_name in self._field_db_names:
+                self.db_txn.delete(dumped_key, db=self._get_sub_db(field_db_name))
+        self.db_txn.delete(dumped_key)
         self._keys.remove(key)
 
     def values(self):
@@ -205,15 +824,31 @@ class lmdbdict:
 
     def flush(self):
         assert self.mode == 'w', 'only flush when in write mode'
+        if self._stats is not None:
+            start = now()
         # update __keys__ value
         self.db_txn.put(b'__keys__', pickle.dumps(self._keys))
+        if self._chunks or self.db_txn.get(b'__chunks__') is not None:
+            self.db_txn.put(b'__chunks__', pickle.dumps(self._chunks))
+        if self._stats is not None:
+            t_commit = now()
         self.db_txn.commit()
         self.db_txn = self.env.begin(write=True)
+        if self._stats is not None:
+            self._stats.record('commit', now() - t_commit)
+            self._stats.record('flush', now() - start)
 
     def sequential_iter(self):
         c = self.db_txn.cursor()
         for k, v in c:
-            if k not in RESERVED:
+            if k not in RESERVED and k not in self._field_db_names:
+                if self._fields is not None:
+                    yield (self._key_loads(k), self._load_record(k))
+                    continue
+                if self._chunks and k in self._chunks:
+                    v = self._read_chunks(k)
+                elif self._dedup:
+                    v = self.db_txn.get(v, db=self._get_sub_db(DEDUP_DB))
                 yield (self._key_loads(k), self._value_loads(v))
 
 
@@ -0,0 +1,164 @@
+# Build a lmdbdict with many writer processes
+import os
+import heapq
+import shutil
+import tempfile
+import itertools
+import pickle
+import multiprocessing
+import lmdb
+from .lmdbdict import lmdbdict, RESERVED
+from .utils import picklable_wrapper
+
+
+def _write_part(args):
+    """
+    Write all the items of tasks into a private staging lmdbdict.
+    """
+    part_path, tasks, item_fn, write_frequency, kwargs = args
+    db = lmdbdict(part_path, 'w', **kwargs)
+    n = 0
+    for task in tasks:
+        for key, value in item_fn(task):
+            db[key] = value
+            n += 1
+            if n % write_frequency == 0:
+                db.flush()
+    del db
+    return part_path
+
+
+def _open_part(part_path):
+    """
+    Open a staging lmdb read-only, mapping only its file. A lmdbdict reader
+    maps 2TB, so opening many parts at once runs out of address space.
+    """
+    env = lmdb.open(part_path, subdir=False, readonly=True, lock=False,
+                    readahead=False, map_size=max(os.path.getsize(part_path), 1 << 20))
+    return env, env.begin(write=False)
+
+
+def _part_keys(txn):
+    keys = txn.get(b'__keys__')
+    return pickle.loads(keys) if keys is not None else []
+
+
+def _raw_items(index, txn):
+    for k, v in txn.cursor():
+        if k not in RESERVED:
+            yield k, index, v
+
+
+def _merge_sorted(txns):
+    """
+    Merge the encoded items of the parts sorted by the encoded key. If a key
+    is in several parts, the one from the latest part wins.
+    """
+    merged = heapq.merge(*[_raw_items(i, txn) for i, txn in enumerate(txns)])
+    for k, group in itertools.groupby(merged, key=lambda x: x[0]):
+        for item in group:
+            pass
+        yield k, item[2]
+
+
+def _saved_methods(db):
+    """
+    The key/value dumps and loads saved in the lmdbdict, as picklable
+    lmdbdict arguments.
+    """
+    kwargs = {}
+    for which in ['key', 'value']:
+        for op in ['dumps', 'loads']:
+            saved = pickle.loads(db.db_txn.get(f'__{which}_{op}__'.encode('ascii')))
+            kwargs[f'{which}_{op}'] = picklable_wrapper(saved)
+    return kwargs
+
+
+def parallel_build(lmdb_path, tasks, item_fn,
+                   num_workers=None, num_parts=None,
+                   staging_dir=None, write_frequency=2500,
+                   **kwargs):
+    """
+    Build the lmdbdict at lmdb_path with several writer processes.
+
+    Args:
+    tasks: a list of work units, e.g. lists of file names.
+    item_fn: a picklable function, item_fn(task) returns an iterable
+    of (key, value) pairs. It's run in the worker processes, together
+    with the key/value dumps, so encoding scales with the number of workers.
+    num_workers: number of writer processes, os.cpu_count() if None.
+    num_parts: the tasks are split into num_parts contiguous parts, each
+    written into a staging lmdbdict by one worker. 4 * num_workers if None.
+    staging_dir: where to put the staging lmdbdicts, a temporary directory
+    next to lmdb_path if None. They are removed afterwards.
+    kwargs: key/value method arguments of lmdbdict. chunk_size, dedup and
+    fields are not supported.
+
+    The staging lmdbdicts are then merged into lmdb_path in the order
+    of the encoded keys, so the target is written with append; the keys
+    keep the order of the tasks. The target has to be a new or empty lmdbdict.
+    Return the number of records and their encoded bytes in the target.
+    """
+    for unsupported in ['chunk_size', 'dedup', 'fields']:
+        assert kwargs.get(unsupported) is None, f'{unsupported} is not supported by parallel_build'
+    num_workers = num_workers or os.cpu_count()
+    num_parts = min(num_parts or 4 * num_workers, max(len(tasks), 1))
+    # Make the user functions picklable so that they can be sent to workers
+    item_fn = picklable_wrapper(item_fn)
+
+    # Check the target before doing all the work
+    db = lmdbdict(lmdb_path, 'w', **kwargs)
+    assert len(db) == 0, 'parallel_build needs a new or empty lmdbdict'
+    # The parts are merged without decoding, so the workers have to encode
+    # with the methods of the target, which may be saved in it already
+    worker_kwargs = _saved_methods(db)
+    del db
+
+    staging_dir = tempfile.mkdtemp(
+        dir=staging_dir or os.path.dirname(os.path.abspath(lmdb_path)),
+        prefix='.lmdbdict_staging_')
+    try:
+        jobs = []
+        for i in range(num_parts):
+            part_tasks = tasks[len(tasks) * i // num_parts: len(tasks) * (i + 1) // num_parts]
+            part_path = os.path.join(staging_dir, f'part-{i:05d}.lmdb')
+            jobs.append((part_path, part_tasks, item_fn, write_frequency, worker_kwargs))
+        with multiprocessing.Pool(num_workers) as pool:
+            part_paths = pool.map(_write_part, jobs, chunksize=1)
+
+        parts = [_open_part(part_path) for part_path in part_paths]
+        txns = [txn for _, txn in parts]
+        db = lmdbdict(lmdb_path, 'w')
+        # Keys sorting after everything in the target can be appended,
+        # which is much faster than random inserts
+        cursor = db.db_txn.cursor()
+        last_key = cursor.key() if cursor.last() else b''
+        n = n_bytes = 0
+        for k, v in _merge_sorted(txns):
+            cursor.put(k, v, append=k > last_key)
+            n += 1
+            n_bytes += len(v)
+            if n % write_frequency == 0:
+                db.db_txn.commit()
+                db.db_txn = db.env.begin(write=True)
+                cursor = db.db_txn.cursor()
+        # A key written by several tasks is kept once, at its last position,
+        # same as its value
+        seen = set()
+        keys = []
+        for key in reversed([key for txn in txns for key in _part_keys(txn)]):
+            dumped_key = db._key_dumps(key)
+            if dumped_key not in seen:
+                seen.add(dumped_key)
+                keys.append(key)
+        keys.reverse()
+        db._keys = keys
+        del txns
+        for env, txn in parts:
+            txn.abort()
+            env.close()
+        db.flush()
+        del db
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return dict(records=n, bytes=n_bytes)
@@ -0,0 +1,96 @@
+# Per operation counters and latency histograms of lmdbdict
+import time
+from .utils import picklable_wrapper
+
+# Latencies are bucketed by the bit length of the nanoseconds,
+# i.e. bucket i counts the latencies in [2^(i-1), 2^i) ns.
+NUM_BUCKETS = 64
+
+try:
+    now = time.perf_counter_ns
+except AttributeError:  # python < 3.7
+    def now():
+        return int(time.perf_counter() * 1e9)
+
+
+class OpStats(object):
+    """
+    Counter, total time, bytes and latency histogram of one operation.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.bytes = 0
+        self.histogram = [0] * NUM_BUCKETS
+
+    def record(self, ns, n_bytes=0):
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        self.bytes += n_bytes
+        self.histogram[min(ns.bit_length(), NUM_BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        """
+        Approximate the q-th (0-100) percentile of the latency in seconds,
+        by the upper bound of the bucket it falls in.
+        """
+        if self.count == 0:
+            return 0.
+        target = self.count * q / 100
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= target:
+                return min(2 ** i, self.max_ns) / 1e9
+        return self.max_ns / 1e9
+
+    def to_dict(self):
+        return dict(
+            count=self.count,
+            total_seconds=self.total_ns / 1e9,
+            mean_seconds=self.total_ns / self.count / 1e9 if self.count else 0.,
+            max_seconds=self.max_ns / 1e9,
+            p50_seconds=self.percentile(50),
+            p99_seconds=self.percentile(99),
+            bytes=self.bytes,
+            # upper bound of the bucket in seconds -> count
+            histogram={2 ** i / 1e9: n for i, n in enumerate(self.histogram) if n},
+        )
+
+
+class Stats(object):
+    """
+    The stats of all the operations of a lmdbdict, and the hooks
+    to export them. A hook is called as hook(op, seconds, n_bytes)
+    after each recorded operation.
+    """
+
+    def __init__(self):
+        self.ops = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        # Make it picklable so that the lmdbdict can still be sent to workers
+        self.hooks.append(picklable_wrapper(hook))
+
+    def record(self, op, ns, n_bytes=0):
+        if op not in self.ops:
+            self.ops[op] = OpStats()
+        self.ops[op].record(ns, n_bytes)
+        for hook in self.hooks:
+            hook(op, ns / 1e9, n_bytes)
+
+    def reset(self):
+        for op_stats in self.ops.values():
+            op_stats.reset()
+
+    def to_dict(self):
+        return {op: op_stats.to_dict() for op, op_stats in self.ops.items()}
+
@@ -20,6 +20,20 @@ def picklable_wrapper(obj):
         return PicklableWrapper(obj)
 
 
+def unwrap(obj):
+    """
+    Return the object wrapped by PicklableWrapper, also inside
+    tuples and dicts, so that it can be called without the indirection.
+    """
+    if isinstance(obj, PicklableWrapper):
+        return obj._obj
+    elif isinstance(obj, tuple):
+        return tuple(map(unwrap, obj))
+    elif isinstance(obj, dict):
+        return {k: unwrap(v) for k, v in obj.items()}
+    return obj
+
+
 def loads_either(cloudpickle_out, pickle_out):
     r"""
     If cloudpickle dumps is available then load with cloudpickle first,
@@ -45,28 +59,33 @@ class PicklableWrapper(object):
     RT change: we save both cloudpickle and pickle dumps.
     This is for the case that sender and receiver may not have the same enviroment.
     cloudpickle is preferred because it's better for callables.
+    The dumps are computed once and cached, so sending the same wrapper
+    to many workers only serializes the object once.
     """
 
     def __init__(self, obj):
         self._obj = obj
+        self._dumps = None
 
     def __reduce__(self):
-        if CLOUDPICKLE_AVAILABLE:
-            s = cloudpickle.dumps(self._obj)
-        else:
-            s = None
-        try:
-            s_ = pickle.dumps(self._obj)
-        except:
-            s_ = None
-        assert not (s is None and s_ is None), 'Fail to dump'
-        return loads_either, (s, s_)
+        if self._dumps is None:
+            if CLOUDPICKLE_AVAILABLE:
+                s = cloudpickle.dumps(self._obj)
+            else:
+                s = None
+            try:
+                s_ = pickle.dumps(self._obj)
+            except:
+                s_ = None
+            assert not (s is None and s_ is None), 'Fail to dump'
+            self._dumps = (s, s_)
+        return loads_either, self._dumps
 
     def __call__(self, *args, **kwargs):
         return self._obj(*args, **kwargs)
 
     def __getattr__(self, attr):
         # Ensure that the wrapped object can be used seamlessly as the previous object.
-        if attr not in ["_obj"]:
+        if attr not in ["_obj", "_dumps"]:
             return getattr(self._obj, attr)
         return getattr(self, attr)
\ No newline at end of file
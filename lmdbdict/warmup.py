@@ -0,0 +1,142 @@
+# Page cache warmup and residency of the lmdb data file
+import os
+import mmap
+import ctypes
+import ctypes.util
+from concurrent.futures import ThreadPoolExecutor
+
+PROT_READ = 0x1
+MAP_SHARED = 0x1
+MADV_WILLNEED = 3
+MAP_FAILED = ctypes.c_void_p(-1).value
+
+
+def data_file(lmdb_path):
+    """
+    The path of the data file, for both subdir and non subdir lmdbs.
+    """
+    if os.path.isdir(lmdb_path):
+        return os.path.join(lmdb_path, 'data.mdb')
+    return lmdb_path
+
+
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                          ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+    libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    return libc
+
+
+def _check(ret, name):
+    if ret != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f'{name} failed: {os.strerror(errno)}')
+
+
+def _with_mapping(path, fn):
+    """
+    Map the file read-only and call fn(libc, addr, size). The python mmap
+    module doesn't expose the address, which madvise and mincore need.
+    """
+    assert os.name == 'posix', 'only supported on posix systems'
+    libc = _libc()
+    size = os.path.getsize(path)
+    if size == 0:
+        return fn(libc, None, 0)
+    with open(path, 'rb') as f:
+        addr = libc.mmap(None, size, PROT_READ, MAP_SHARED, f.fileno(), 0)
+        if addr in (None, MAP_FAILED):
+            _check(-1, 'mmap')
+        try:
+            return fn(libc, addr, size)
+        finally:
+            libc.munmap(addr, size)
+
+
+def _read_range(path, start, end, block_size):
+    buf = bytearray(block_size)
+    n = 0
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(start)
+        while start + n < end:
+            view = memoryview(buf)[:min(block_size, end - start - n)]
+            got = f.readinto(view)
+            if not got:
+                break
+            n += got
+    return n
+
+
+def read_file(path, num_threads=8, block_size=1 << 24):
+    """
+    Pull the file into the page cache by reading num_threads contiguous
+    ranges of it in parallel, each sequentially. Return the bytes read.
+    """
+    size = os.path.getsize(path)
+    bounds = [size * i // num_threads for i in range(num_threads + 1)]
+    with ThreadPoolExecutor(num_threads) as pool:
+        return sum(pool.map(lambda i: _read_range(path, bounds[i], bounds[i + 1], block_size),
+                            range(num_threads)))
+
+
+def madvise_willneed(path):
+    """
+    Ask the kernel to read the file into the page cache in the background.
+    Return the size of the file.
+    """
+    def advise(libc, addr, size):
+        if size:
+            _check(libc.madvise(addr, size, MADV_WILLNEED), 'madvise')
+        return size
+    return _with_mapping(path, advise)
+
+
+def residency(path):
+    """
+    Return how much of the file is in the page cache.
+    """
+    def count(libc, addr, size):
+        num_pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+        if num_pages == 0:
+            return 0
+        vec = (ctypes.c_ubyte * num_pages)()
+        _check(libc.mincore(addr, size, vec), 'mincore')
+        return sum(v & 1 for v in vec)
+    resident_pages = _with_mapping(path, count)
+    size = os.path.getsize(path)
+    resident_bytes = min(resident_pages * mmap.PAGESIZE, size)
+    return dict(
+        path=path,
+        file_bytes=size,
+        resident_bytes=resident_bytes,
+        resident_fraction=resident_bytes / size if size else 1.0,
+    )
+
+
+def main():
+    import json
+    import argparse
+    from .lmdbdict import lmdbdict
+    parser = argparse.ArgumentParser(
+        description='Warm up the page cache of lmdbdicts, or report how much of them is cached.')
+    parser.add_argument('lmdb', type=str, nargs='+')
+    parser.add_argument('--method', type=str, default='read', choices=['read', 'madvise'])
+    parser.add_argument('-j', '--threads', type=int, default=8)
+    parser.add_argument('--report', action='store_true',
+                        help='only print the residency, without warming up')
+    args = parser.parse_args()
+
+    for lmdb_path in args.lmdb:
+        if not args.report:
+            db = lmdbdict(lmdb_path, 'r')
+            db.warmup(method=args.method, num_threads=args.threads)
+            del db
+        print(json.dumps(residency(data_file(lmdb_path))))
+
+
+if __name__ == '__main__':
+    main()
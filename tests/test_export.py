@@ -0,0 +1,98 @@
+from lmdbdict import lmdbdict
+from lmdbdict import export
+import pytest
+import os
+import io
+import tarfile
+
+
+@pytest.fixture
+def bytes_lmdb(tmpdir):
+    path = os.path.join(tmpdir, 'test.lmdb')
+    test_dict = lmdbdict(path, 'w', key_method='utf8', value_method='identity')
+    for i in range(50):
+        test_dict[f'folder{i % 3}/{i}.bin'] = os.urandom(i * 10)
+    del test_dict
+    return path
+
+
+def _read(path):
+    test_dict = lmdbdict(path, 'r')
+    out = {k: test_dict[k] for k in test_dict.keys()}
+    test_dict.env.close()
+    return out
+
+
+def test_export_folder(tmpdir, bytes_lmdb):
+    inputs = _read(bytes_lmdb)
+    out_dir = os.path.join(tmpdir, 'out')
+    stats = export.export_folder(bytes_lmdb, out_dir, num_workers=2, num_segments=7)
+    assert stats['records'] == len(inputs)
+    for k, v in inputs.items():
+        with open(os.path.join(out_dir, k), 'rb') as f:
+            assert f.read() == v
+
+
+def test_export_tar(tmpdir, bytes_lmdb):
+    inputs = _read(bytes_lmdb)
+    out_dir = os.path.join(tmpdir, 'out')
+    export.export_tar(bytes_lmdb, out_dir, num_workers=2, num_segments=7)
+    outputs = {}
+    for fn in os.listdir(out_dir):
+        with tarfile.open(os.path.join(out_dir, fn)) as tar:
+            for member in tar.getmembers():
+                outputs[member.name] = tar.extractfile(member).read()
+    assert outputs == inputs
+
+
+def test_convert_checksum_compare(tmpdir, bytes_lmdb):
+    inputs = _read(bytes_lmdb)
+    converted = os.path.join(tmpdir, 'converted.lmdb')
+    export.convert(bytes_lmdb, converted, num_workers=2, num_segments=5,
+                   key_method='utf8', value_method='pickle')
+    assert _read(converted) == inputs
+
+    out = io.StringIO()
+    stats = export.checksum(bytes_lmdb, out=out, num_workers=2, num_segments=7)
+    assert stats['records'] == len(inputs)
+    assert len(out.getvalue().splitlines()) == len(inputs)
+    assert export.checksum(bytes_lmdb, num_workers=3)['digest'] == stats['digest']
+
+    assert export.compare(bytes_lmdb, bytes_lmdb, num_workers=2)['same']
+
+    changed = os.path.join(tmpdir, 'changed.lmdb')
+    test_dict = lmdbdict(changed, 'w', key_method='utf8', value_method='identity')
+    test_dict.update(inputs)
+    test_dict['folder0/0.bin'] = b'changed'
+    del test_dict['folder1/1.bin']
+    test_dict['new'] = b''
+    del test_dict
+    stats = export.compare(bytes_lmdb, changed, num_workers=2, num_segments=7)
+    assert not stats['same']
+    assert stats['only_a'] == ['folder1/1.bin']
+    assert stats['only_b'] == ['new']
+    assert stats['different'] == ['folder0/0.bin']
+    assert export.checksum(changed, num_workers=2)['digest'] != \
+        export.checksum(bytes_lmdb, num_workers=2)['digest']
+
+
+def test_segments(bytes_lmdb):
+    test_dict = lmdbdict(bytes_lmdb, 'r')
+    # more segments than asked for, to keep each under max_records
+    segments = export.segments(test_dict, 2, max_records=10)
+    assert len(segments) >= 5
+    sizes = [len(list(export._iter_segment(test_dict, segment))) for segment in segments]
+    assert max(sizes) <= 10
+    assert sum(sizes) == 50
+    assert len(export.segments(test_dict, 7, max_records=1000)) == 7
+    test_dict.env.close()
+
+
+def test_export_folder_outside(tmpdir):
+    path = os.path.join(tmpdir, 'test.lmdb')
+    test_dict = lmdbdict(path, 'w', key_method='utf8', value_method='identity')
+    test_dict['../outside.bin'] = b'x'
+    del test_dict
+    with pytest.raises(ValueError):
+        export.export_folder(path, os.path.join(tmpdir, 'out'), num_workers=1)
+    assert not os.path.exists(os.path.join(tmpdir, 'outside.bin'))
@@ -1,9 +1,11 @@
 from lmdbdict import lmdbdict, LMDBDict
+from lmdbdict.utils import PicklableWrapper
 import pytest
 import os
 import numpy as np
 import pickle
 import random
+from unittest import mock
 try:
     import cloudpickle
 except:
@@ -197,4 +199,214 @@ def test_unsafe(tmpdir, random_input, module):
 
 def test_sequential_iter(random_lmdbdict):
     for k,v in random_lmdbdict.sequential_iter():
-        print(k, v)
\ No newline at end of file
+        print(k, v)
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 7, 64])
+def test_chunked_values(tmpdir, chunk_size):
+    inputs = {
+        'small': b'abc',
+        'large': bytes(range(256)) * 3,
+        'empty': b'',
+    }
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w',
+                         value_method='identity', chunk_size=chunk_size)
+    for k, v in inputs.items():
+        test_dict[k] = v
+    test_dict['deleted'] = b'x' * 100
+    del test_dict['deleted']
+    del test_dict
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+
+    for k, v in inputs.items():
+        assert test_dict[k] == v
+        assert test_dict.value_size(k) == len(v)
+        for offset, length in [(0, None), (0, 5), (3, 100), (500, 300), (1000, 1)]:
+            end = None if length is None else offset + length
+            assert test_dict.read_range(k, offset, length) == v[offset:end]
+        with test_dict.open(k) as f:
+            f.seek(2)
+            assert f.read(10) == v[2:12]
+            f.seek(-len(v[-4:]), os.SEEK_END)
+            assert f.read() == v[-4:]
+    assert dict(test_dict.sequential_iter()) == inputs
+    assert 'deleted' not in test_dict
+
+
+def test_dedup(tmpdir, random_input):
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', dedup=True)
+    for k, v in random_input.items():
+        test_dict[k] = v
+    for i in range(10):
+        test_dict[f'copy{i}'] = b'x' * 1000
+    test_dict['copy0'] = b'y' * 1000  # overwrite
+    del test_dict['copy1']
+    stats = test_dict.dedup_stats()
+    assert stats['n_refs'] == len(random_input) + 9
+    assert stats['dedup_ratio'] > 1
+    del test_dict
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+
+    for k, v in random_input.items():
+        assert test_dict[k] == v
+    assert test_dict['copy0'] == b'y' * 1000
+    assert test_dict['copy2'] == b'x' * 1000
+    assert 'copy1' not in test_dict
+    assert len(dict(test_dict.sequential_iter())) == len(random_input) + 9
+    assert test_dict.dedup_stats() == stats
+
+
+def test_dedup_del_missing_record(tmpdir):
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', dedup=True)
+    test_dict['a'] = b'x'
+    test_dict['b'] = b'x'
+    # the key is listed but its record is gone
+    test_dict.db_txn.delete(test_dict._key_dumps('a'))
+    del test_dict['a']
+    assert 'a' not in test_dict
+    assert test_dict['b'] == b'x'
+
+
+def test_dedup_nonempty_error(tmpdir):
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w')
+    test_dict[0] = 0
+    del test_dict
+    with pytest.raises(AssertionError):
+        test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', dedup=True)
+
+
+@pytest.mark.skipif(not CLOUDPICKLE_AVAILABLE, reason="PickableWrapper requires cloudpickle")
+def test_fields(tmpdir):
+    fields = {
+        'image': 'identity',
+        'caption': 'utf8',
+        'boxes': None,
+        'scale': (lambda x: str(x).encode('ascii'), lambda x: float(x)),
+    }
+    inputs = {
+        i: {'image': bytes([i]) * 10, 'caption': f'caption {i}',
+            'boxes': np.arange(i), 'scale': i / 2}
+        for i in range(5)
+    }
+    inputs[5] = {'caption': 'no image'}
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', fields=fields)
+    for k, v in inputs.items():
+        test_dict[k] = v
+    with pytest.raises(AssertionError):
+        test_dict[6] = {'unknown': 1}
+    del test_dict
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+
+    def check(record, expected):
+        assert record.keys() == expected.keys()
+        for field, v in expected.items():
+            assert np.all(record[field] == v)
+
+    for k, v in inputs.items():
+        check(test_dict[k], v)
+        only = {f: v[f] for f in ['caption', 'scale'] if f in v}
+        check(test_dict.get(k, fields=['caption', 'scale']), only)
+    for record, k in zip(test_dict.get_batch([3, 5, 1], fields=['boxes']), [3, 5, 1]):
+        check(record, {f: v for f, v in inputs[k].items() if f == 'boxes'})
+    assert test_dict.get(100) is None
+    for k, v in test_dict.sequential_iter():
+        check(v, inputs[k])
+
+
+def test_stats(tmpdir, random_input):
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', instrument=True)
+    for k, v in random_input.items():
+        test_dict[k] = v
+    test_dict.flush()
+    ops = test_dict.stats()['ops']
+    assert ops['setitem']['count'] == len(random_input)
+    assert ops['flush']['count'] == ops['commit']['count'] == 1
+    del test_dict
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r', instrument=True)
+    events = []
+    test_dict.add_stats_hook(lambda op, seconds, n_bytes: events.append(op))
+    for k in random_input:
+        test_dict[k]
+    with pytest.raises(KeyError):
+        test_dict['not a key']
+
+    stats = test_dict.stats(reset=True)
+    assert stats['len'] == len(random_input)
+    assert 'entries' in stats and 'map_size' in stats
+    n = len(random_input)
+    assert stats['ops']['key_check']['count'] == n + 1
+    assert stats['ops']['getitem']['count'] == stats['ops']['decode']['count'] == n
+    assert stats['ops']['fetch']['bytes'] > 0
+    assert sum(stats['ops']['getitem']['histogram'].values()) == n
+    assert events.count('getitem') == n
+    assert test_dict.stats()['ops']['getitem']['count'] == 0
+
+
+def test_stats_chunked(tmpdir):
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', value_method='identity',
+                         chunk_size=4, instrument=True)
+    test_dict['a'] = bytes(range(16))
+    setitem = test_dict.stats()['ops']['setitem']
+    assert setitem['count'] == 1
+    assert setitem['bytes'] == 16
+    assert 0 < setitem['max_seconds'] < 60
+
+
+@pytest.mark.skipif(not CLOUDPICKLE_AVAILABLE, reason="PickableWrapper requires cloudpickle")
+def test_pickle_unwrapped_codecs(tmpdir, random_input):
+    kwargs = dict(
+        value_dumps=lambda x: pickle.dumps(x),
+        value_loads=lambda x: pickle.loads(x)
+    )
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', **kwargs)
+    for k, v in random_input.items():
+        test_dict[k] = v
+    del test_dict
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+    # The hot path calls the functions directly
+    assert not isinstance(test_dict._value_loads, PicklableWrapper)
+
+    dumped = pickle.dumps(test_dict)
+    # Pickling does not close the original
+    for k, v in random_input.items():
+        assert test_dict[k] == v
+    # The wrapper dumps are cached
+    with mock.patch('lmdbdict.utils.cloudpickle.dumps', side_effect=AssertionError):
+        assert pickle.dumps(test_dict) == dumped
+    # Like sending it to a worker, which can send it again
+    for _ in range(2):
+        test_dict.env.close()
+        test_dict = pickle.loads(dumped)
+        assert not isinstance(test_dict._value_loads, PicklableWrapper)
+        for k, v in random_input.items():
+            assert test_dict[k] == v
+        dumped = pickle.dumps(test_dict)
+
+
+@pytest.mark.parametrize("method", ['read', 'madvise'])
+def test_warmup(tmpdir, method):
+    inputs = {i: os.urandom(10000) for i in range(20)}
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', value_method='identity')
+    test_dict.update(inputs)
+    del test_dict
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+
+    file_bytes = os.path.getsize(os.path.join(tmpdir, 'test.lmdb'))
+    assert test_dict.warmup(method=method) == file_bytes
+    assert test_dict.warmup(keys=[3, 1, 2], method=method) == 30000
+    assert test_dict.warmup(keys=list(inputs), num_threads=3) == 200000
+    with pytest.raises(ValueError):
+        test_dict.warmup(keys=[1], method='unknown')
+    report = test_dict.residency()
+    assert report['file_bytes'] == file_bytes
+    assert 0 <= report['resident_fraction'] <= 1
+
+
+def test_warmup_keys_chunked(tmpdir):
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', value_method='identity',
+                         chunk_size=100)
+    test_dict.update({i: os.urandom(1000) for i in range(10)})
+    assert test_dict.warmup(keys=range(10), num_threads=4) == 10000
+    del test_dict
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+    assert test_dict.warmup(keys=range(10), num_threads=4) == 10000
+    assert len(test_dict[3]) == 1000
@@ -0,0 +1,63 @@
+from lmdbdict import lmdbdict
+from lmdbdict.parallel import parallel_build
+import pytest
+import os
+
+
+def _items(task):
+    for i in range(task * 10, task * 10 + 10):
+        yield i, {'value': i}
+    yield f'str{task}', str(task)
+
+
+@pytest.mark.parametrize("key_method", [None, 'ascii'])
+def test_parallel_build(tmpdir, key_method):
+    tasks = list(range(13))
+    if key_method == 'ascii':
+        item_fn = _ascii_items
+    else:
+        item_fn = _items
+    parallel_build(os.path.join(tmpdir, 'test.lmdb'), tasks, item_fn,
+                   num_workers=3, write_frequency=7, key_method=key_method)
+    expected = [kv for task in tasks for kv in item_fn(task)]
+
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+    assert test_dict.keys() == [k for k, _ in expected]
+    for k, v in expected:
+        assert test_dict[k] == v
+    assert len(list(test_dict.sequential_iter())) == len(expected)
+    assert os.listdir(tmpdir) == ['test.lmdb'] or \
+        sorted(os.listdir(tmpdir)) == ['test.lmdb', 'test.lmdb-lock']
+
+
+def _ascii_items(task):
+    for k, v in _items(task):
+        yield str(k), v
+
+
+def _duplicated_items(task):
+    yield 'shared', task
+    yield task, task
+
+
+def test_parallel_build_duplicates_and_many_parts(tmpdir):
+    tasks = list(range(100))
+    parallel_build(os.path.join(tmpdir, 'test.lmdb'), tasks, _duplicated_items,
+                   num_workers=2, num_parts=100)
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+    assert test_dict.keys() == tasks[:-1] + ['shared', 99]
+    assert test_dict['shared'] == 99
+    assert len(test_dict) == len(tasks) + 1
+
+
+def _bytes_items(task):
+    yield task, b'v%d' % task
+
+
+def test_parallel_build_saved_methods(tmpdir):
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'w', value_method='identity')
+    del test_dict
+    parallel_build(os.path.join(tmpdir, 'test.lmdb'), [1, 2], _bytes_items, num_workers=2)
+    test_dict = lmdbdict(os.path.join(tmpdir, 'test.lmdb'), 'r')
+    assert test_dict[1] == b'v1'
+    assert test_dict[2] == b'v2'
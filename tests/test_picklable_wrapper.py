@@ -1,5 +1,5 @@
 import pytest
-from lmdbdict.utils import PicklableWrapper, picklable_wrapper
+from lmdbdict.utils import PicklableWrapper, picklable_wrapper, unwrap
 import pickle
 try:
     import cloudpickle
@@ -46,4 +46,18 @@ def test_no_cloudpickle_when_receive():
     with mock.patch('lmdbdict.utils.CLOUDPICKLE_AVAILABLE', False):
         with mock.patch('lmdbdict.utils.cloudpickle', pickle):
             # without cloudpickle
-            pickle.loads(tmp)
\ No newline at end of file
+            pickle.loads(tmp)
+
+@pytest.mark.skipif(not CLOUDPICKLE_AVAILABLE, reason="PickableWrapper requires cloudpickle")
+def test_picklablewrapper_cached_dumps():
+    wrapper = PicklableWrapper(lambda x: x)
+    fn_bytes = pickle.dumps(wrapper)
+    with mock.patch('lmdbdict.utils.cloudpickle.dumps', side_effect=AssertionError):
+        assert pickle.dumps(wrapper) == fn_bytes
+
+
+def test_unwrap():
+    fn = _temporary_func
+    assert unwrap(PicklableWrapper(fn)) is fn
+    assert unwrap({'a': (PicklableWrapper(fn), 1)}) == {'a': (fn, 1)}
+    assert unwrap(fn) is fn